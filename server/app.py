@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import datetime
+import os
 from flask import Flask
 from flask_cors import CORS
 import secrets
@@ -8,13 +9,17 @@ from sqlalchemy import MetaData
 from flask import make_response, request, jsonify
 from flask_restx import Resource, Api, Namespace, fields
 from models import db, HeroPower, Hero, Power
+from read_model import read_model
+from group_commit import group_commit
+from profiling import profiler
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__)
 secret_key = secrets.token_hex(16)
 app.config['SECRET_KEY'] = secret_key
-app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///app.db'
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get('DATABASE_URI', 'sqlite:///app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.json.compact = False
 
@@ -24,6 +29,9 @@ metadata = MetaData(naming_convention={
 
 migrate = Migrate(app, db)
 db.init_app(app)
+read_model.init_app(app)
+group_commit.init_app(app)
+profiler.init_app(app)
 
 api = Api(app)
 heroes = Namespace("heroes")
@@ -81,6 +89,36 @@ hero_powers_input_model = api.model('hero_powers_input_model', {
 })
 
 
+# ----------------------- H E L P E R S -----------------------
+
+def etag(instance):
+    return {"ETag": f'"{instance.version}"'}
+
+
+def version_matches(instance):
+    # A missing If-Match or `*` matches any version.
+    if not request.if_match or request.if_match.star_tag:
+        return True
+    return request.if_match.contains(str(instance.version))
+
+
+def apply_patch(instance, payload):
+    for attr in payload:
+        if attr != 'version':
+            setattr(instance, attr, payload[attr])
+
+
+def commit_patch():
+    # version_id_col makes the flush a single UPDATE ... WHERE id = ? AND version = ?,
+    # which matches no row if another request committed first.
+    try:
+        db.session.commit()
+        return True
+    except StaleDataError:
+        db.session.rollback()
+        return False
+
+
 # ----------------------- A P I _ R O U T E S -----------------------
 
 @home.route('/')
@@ -97,6 +135,8 @@ class Home(Resource):
 class Heroes(Resource):
     @heroes.marshal_list_with(heroes_model)
     def get(self):
+        if read_model.enabled:
+            return read_model.heroes()
         return Hero.query.all()
 
     @heroes.expect(hero_input_model)
@@ -107,8 +147,7 @@ class Heroes(Resource):
             name=heroes.payload['name'],
             super_name=heroes.payload['super_name']
         )
-        db.session.add(new_hero)
-        db.session.commit()
+        new_hero = group_commit.add(new_hero)
         return new_hero, 201
 
 
@@ -116,9 +155,12 @@ class Heroes(Resource):
 class HeroesByID(Resource):
     @heroes.marshal_list_with(hero_model)
     def get(self, id):
-        hero = Hero.query.filter_by(id=id).first()
+        if read_model.enabled:
+            hero = read_model.hero(id)
+        else:
+            hero = Hero.query.filter_by(id=id).first()
         if hero:
-            return hero, 200
+            return hero, 200, etag(hero)
         else:
             response = {
                 "error": "Restaurant not found"
@@ -129,11 +171,14 @@ class HeroesByID(Resource):
     @heroes.marshal_with(heroes_model)
     def patch(self, id):
         hero = Hero.query.filter_by(id=id).first()
-        for attr in heroes.payload:
-            setattr(hero, attr, heroes.payload[attr])
-        db.session.add(hero)
-        db.session.commit()
-        return hero, 201
+        if not hero:
+            heroes.abort(404, "Hero not found")
+        if not version_matches(hero):
+            heroes.abort(412, "Hero has been modified")
+        apply_patch(hero, heroes.payload)
+        if not commit_patch():
+            heroes.abort(412, "Hero has been modified")
+        return hero, 201, etag(hero)
 
     def delete(self, id):
         hero = Hero.query.filter_by(id=id).first()
@@ -156,6 +201,8 @@ class HeroesByID(Resource):
 class Powers(Resource):
     @powers.marshal_list_with(powers_model)
     def get(self):
+        if read_model.enabled:
+            return read_model.powers()
         return Power.query.all()
 
     @powers.expect(power_input_model)
@@ -166,8 +213,7 @@ class Powers(Resource):
             name=powers.payload['name'],
             description=powers.payload['description']
         )
-        db.session.add(new_power)
-        db.session.commit()
+        new_power = group_commit.add(new_power)
         return new_power, 201
 
 
@@ -175,9 +221,12 @@ class Powers(Resource):
 class PowersByID(Resource):
     @powers.marshal_with(power_model)
     def get(self, id):
-        power = Power.query.filter_by(id=id).first()
+        if read_model.enabled:
+            power = read_model.power(id)
+        else:
+            power = Power.query.filter_by(id=id).first()
         if power:
-            return power, 200
+            return power, 200, etag(power)
         else:
             return {"error": "Power not found"}, 404
 
@@ -186,12 +235,13 @@ class PowersByID(Resource):
     def patch(self, id):
         power = Power.query.filter_by(id=id).first()
         if power:
-            for attr in powers.payload:
-                setattr(power, attr, powers.payload[attr])
+            if not version_matches(power):
+                powers.abort(412, "Power has been modified")
+            apply_patch(power, powers.payload)
             try:
-                db.session.add(power)
-                db.session.commit()
-                return power, 201
+                if not commit_patch():
+                    powers.abort(412, "Power has been modified")
+                return power, 201, etag(power)
             except SQLAlchemyError as e:
                 db.session.rollback()
                 response = {
@@ -236,8 +286,7 @@ class HeroPowers(Resource):
                 power_id=hero_powers.payload['power_id'],
                 strength=hero_powers.payload['strength']
             )
-            db.session.add(new_hero_power)
-            db.session.commit()
+            new_hero_power = group_commit.add(new_hero_power)
             hero = Hero.query.filter_by(id=new_hero_power.hero_id).first()
             return hero, 201
         except Exception as e:
@@ -253,7 +302,7 @@ class HeroPowersByID(Resource):
     def get(self, id):
         hero_power = HeroPower.query.filter_by(id=id).first()
         if hero_power:
-            return hero_power, 200
+            return hero_power, 200, etag(hero_power)
         else:
             return {"error": "hero power not found"}, 404
 
@@ -262,12 +311,13 @@ class HeroPowersByID(Resource):
     def patch(self, id):
         hero_power = HeroPower.query.filter_by(id=id).first()
         if hero_power:
-            for attr in hero_powers.payload:
-                setattr(hero_power, attr, hero_powers.payload[attr])
-            db.session.add(hero_power)
-            db.session.commit()
+            if not version_matches(hero_power):
+                hero_powers.abort(412, "Hero power has been modified")
+            apply_patch(hero_power, hero_powers.payload)
+            if not commit_patch():
+                hero_powers.abort(412, "Hero power has been modified")
             hero = Hero.query.filter_by(id=Hero.id).first()
-            return hero, 201
+            return hero, 201, etag(hero_power)
         else:
             return {"message": "hero power not found."}, 404
 
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Compare the ORM and in-memory read model paths on a synthetic seed.
+
+    python benchmark.py reads [rows]
+    python benchmark.py writes [requests]
+    python benchmark.py patches [increments]
+
+Each run uses a throwaway SQLite database, so app.db is left untouched.
+"""
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+STRENGTHS = ["Strong", "Weak", "Average"]
+
+
+def seed(path, rows):
+    import sqlite3
+    from sqlalchemy import create_engine
+    from models import db
+
+    db.metadata.create_all(create_engine(f'sqlite:///{path}'))
+    conn = sqlite3.connect(path)
+    powers = max(rows // 1000, 4)
+    conn.executemany(
+        "INSERT INTO powers (id, name, description) VALUES (?, ?, ?)",
+        ((i, f'power {i}', f'description of power number {i}') for i in range(1, powers + 1)))
+    conn.executemany(
+        "INSERT INTO heroes (id, name, super_name) VALUES (?, ?, ?)",
+        ((i, f'hero {i}', f'super {i}') for i in range(1, rows + 1)))
+    conn.executemany(
+        "INSERT INTO hero_powers (hero_id, power_id, strength) VALUES (?, ?, ?)",
+        ((i, random.randint(1, powers), random.choice(STRENGTHS)) for i in range(1, rows + 1)))
+    conn.commit()
+    conn.close()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def memory_kb():
+    # Private_Dirty is what a worker can't share with the master; Pss splits
+    # shared pages between the processes mapping them.
+    usage = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Private_Dirty'):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def reads_serve(rows, requests):
+    from app import app
+    from read_model import read_model
+    random.seed(os.getpid())
+    client = app.test_client()
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(f'/heroes/heroes/{random.randint(1, rows)}')
+        samples.append(time.perf_counter() - start)
+    result = {'samples': samples, 'served': memory_kb()}
+    if read_model.enabled:
+        # Read every row once, as a long-lived worker eventually would.
+        with app.app_context():
+            for id in range(1, rows + 1):
+                hero = read_model.hero(id)
+                hero.name, hero.super_name, [power.name for power in hero.powers]
+        result['swept'] = memory_kb()
+    return result
+
+
+def reads_worker(rows, workers=4, requests=2000):
+    # Mirrors gunicorn: build in the master (with gunicorn.conf.py's preload for
+    # the read model), fork the workers, and measure each of them.
+    import gc
+    import json
+    from app import app
+    from read_model import read_model
+    read_model.preload(app)
+    gc.freeze()
+    master = memory_kb()
+
+    pipes = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        if os.fork() == 0:
+            os.close(read_end)
+            with os.fdopen(write_end, 'w') as out:
+                json.dump(reads_serve(rows, requests), out)
+            os._exit(0)
+        os.close(write_end)
+        pipes.append(read_end)
+    results = []
+    for read_end in pipes:
+        with os.fdopen(read_end) as result:
+            results.append(json.load(result))
+        os.wait()
+
+    def per_worker(key, field):
+        return sum(result[key][field] for result in results) / len(results) / 1024
+
+    samples = [sample for result in results for sample in result['samples']]
+    mode = 'read model' if read_model.enabled else 'orm'
+    print(f'{mode:>10}: master rss {master["Rss"] / 1024:.1f} MiB, per worker after {requests} GETs: '
+          f'private dirty {per_worker("served", "Private_Dirty"):.1f} MiB, pss {per_worker("served", "Pss"):.1f} MiB, '
+          f'p50 {percentile(samples, 0.5) * 1000:.3f} ms, p99 {percentile(samples, 0.99) * 1000:.3f} ms')
+    if read_model.enabled:
+        print(f'{"":>10}  per worker after reading all {rows} heroes: '
+              f'private dirty {per_worker("swept", "Private_Dirty"):.1f} MiB, pss {per_worker("swept", "Pss"):.1f} MiB')
+
+
+def reads(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        seed(path, rows)
+        for enabled in ('0', '1'):
+            env = dict(os.environ, DATABASE_URI=f'sqlite:///{path}', READ_MODEL_ENABLED=enabled)
+            subprocess.run([sys.executable, __file__, 'reads-worker', str(rows)], env=env, check=True)
+
+
+def writes_worker(requests, concurrency=(1, 4, 16, 64)):
+    from app import app
+    mode = 'group' if app.config['GROUP_COMMIT_ENABLED'] else 'per-request'
+    for threads in concurrency:
+        samples = []
+
+        def post(offset):
+            client = app.test_client()
+            for i in range(offset, requests, threads):
+                start = time.perf_counter()
+                client.post('/heroes/heroes', json={'name': f'hero {threads}-{i}', 'super_name': 'bench'})
+                samples.append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=post, args=(offset,)) for offset in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print(f'{mode:>11} x{threads:<3}: {len(samples) / elapsed:8.0f} writes/s, '
+              f'p99 {percentile(samples, 0.99) * 1000:.2f} ms')
+
+
+def writes(requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        for enabled in ('0', '1'):
+            path = os.path.join(tmp, f'bench-{enabled}.db')
+            seed(path, 0)
+            env = dict(os.environ, DATABASE_URI=f'sqlite:///{path}', GROUP_COMMIT_ENABLED=enabled)
+            subprocess.run([sys.executable, __file__, 'writes-worker', str(requests)], env=env, check=True)
+
+
+def patches_worker(increments, threads=8):
+    # Each thread bumps a counter kept in a hero's super_name with GET then PATCH.
+    # With If-Match every increment must survive, and the run exits non-zero if
+    # any is lost; without it some are expected to be.
+    from app import app
+    client = app.test_client()
+    for if_match in (False, True):
+        client.patch('/heroes/heroes/1', json={'super_name': '0'})
+        conflicts = []
+        failures = []
+
+        def bump():
+            try:
+                increment()
+            except Exception as e:
+                failures.append(e)
+
+        def increment():
+            client = app.test_client()
+            done = 0
+            while done < increments:
+                current = client.get('/heroes/heroes/1')
+                headers = {'If-Match': current.headers['ETag']} if if_match else {}
+                response = client.patch('/heroes/heroes/1', headers=headers,
+                                        json={'super_name': str(int(current.json['super_name']) + 1)})
+                if response.status_code == 412:
+                    conflicts.append(1)
+                    continue
+                if response.status_code != 201:
+                    raise RuntimeError(f'PATCH returned {response.status_code}: {response.get_data(as_text=True)}')
+                done += 1
+
+        workers = [threading.Thread(target=bump) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if failures:
+            raise failures[0]
+        final = int(client.get('/heroes/heroes/1').json['super_name'])
+        label = 'If-Match' if if_match else 'no If-Match'
+        print(f'{label:>11}: expected {threads * increments}, got {final}, '
+              f'lost {threads * increments - final}, 412 retries {len(conflicts)}')
+        if if_match and final != threads * increments:
+            sys.exit(f'lost updates with If-Match: expected {threads * increments}, got {final}')
+
+
+def patches(increments):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        seed(path, 1)
+        env = dict(os.environ, DATABASE_URI=f'sqlite:///{path}')
+        subprocess.run([sys.executable, __file__, 'patches-worker', str(increments)], env=env, check=True)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'reads'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    if command == 'reads':
+        reads(rows)
+    elif command == 'reads-worker':
+        reads_worker(rows, workers=int(os.environ.get('WORKERS', 4)))
+    elif command == 'writes':
+        writes(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif command == 'writes-worker':
+        writes_worker(rows)
+    elif command == 'patches':
+        patches(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    elif command == 'patches-worker':
+        patches_worker(rows)
+    else:
+        sys.exit(f'unknown benchmark: {command}')
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models import db
+
+
+class _Pending:
+    __slots__ = ('instance', 'error', 'committed', 'done', 'wake')
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.error = None
+        self.committed = False
+        self.done = False
+        # Set once the row is committed, or when its caller is handed leadership.
+        self.wake = threading.Event()
+
+
+class GroupCommit:
+    """Coalesce concurrent single-row inserts in a worker into one transaction.
+
+    The first caller to arrive becomes the leader: it waits for the window,
+    takes every row queued meanwhile and commits them together. Rows that
+    arrive during that commit queue up, and when it finishes the first of
+    them takes over as leader and commits them all at once, so only one
+    transaction is ever in flight. If a commit fails, each row is retried in
+    its own transaction so only the offending caller sees the error.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.window = 0.002
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leading = False
+
+    def init_app(self, app):
+        app.config.setdefault('GROUP_COMMIT_ENABLED', os.environ.get('GROUP_COMMIT_ENABLED') == '1')
+        app.config.setdefault('GROUP_COMMIT_WINDOW_MS', float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 2)))
+        self.enabled = app.config['GROUP_COMMIT_ENABLED']
+        self.window = app.config['GROUP_COMMIT_WINDOW_MS'] / 1000
+
+    def add(self, instance):
+        if not self.enabled:
+            db.session.add(instance)
+            db.session.commit()
+            return instance
+
+        item = _Pending(instance)
+        with self._lock:
+            self._pending.append(item)
+            lead = not self._leading
+            self._leading = True
+        if lead:
+            time.sleep(self.window)
+        else:
+            item.wake.wait()
+        if not item.done:
+            self._lead()
+        if item.error is not None:
+            raise item.error
+        # Attach the committed row to the request's session so relationships
+        # can still be lazy loaded while marshalling the response.
+        return db.session.merge(instance, load=False)
+
+    def _lead(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        try:
+            self._commit(batch)
+        finally:
+            # Even if the commit is interrupted (SystemExit on worker shutdown,
+            # say), pass leadership on so queued callers aren't left waiting.
+            with self._lock:
+                if self._pending:
+                    self._pending[0].wake.set()
+                else:
+                    self._leading = False
+
+    def _commit(self, batch):
+        try:
+            self._commit_batch(batch)
+        except BaseException as e:
+            # Anything unexpected still has to reach every caller whose row
+            # didn't make it, rather than leaving them to find out later.
+            for item in batch:
+                if not item.committed and item.error is None:
+                    item.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            for item in batch:
+                item.done = True
+                item.wake.set()
+
+    def _commit_batch(self, batch):
+        try:
+            with Session(db.engine, expire_on_commit=False) as session:
+                session.add_all(item.instance for item in batch)
+                session.commit()
+        except SQLAlchemyError as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                for item in batch:
+                    self._commit_one(item)
+        else:
+            for item in batch:
+                item.committed = True
+
+    def _commit_one(self, item):
+        try:
+            with Session(db.engine, expire_on_commit=False) as session:
+                session.add(item.instance)
+                session.commit()
+        except SQLAlchemyError as e:
+            item.error = e
+        else:
+            item.committed = True
+
+
+group_commit = GroupCommit()
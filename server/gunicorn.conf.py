@@ -0,0 +1,13 @@
+import gc
+
+# Build shared state in the master before workers are forked.
+preload_app = True
+
+
+def when_ready(server):
+    from app import app
+    from read_model import read_model
+    read_model.preload(app)
+    # Move everything built so far out of the collector's reach, so GC passes in
+    # the workers don't write to (and un-share) the pages it lives on.
+    gc.freeze()
@@ -18,6 +18,9 @@ class Hero(db.Model):
     super_name = db.Column(db.String)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     heropowers = db.relationship('HeroPower', back_populates='hero', cascade='all, delete-orphan')
     powers = association_proxy('heropowers', 'power')
@@ -34,6 +37,9 @@ class Power(db.Model):
     description = db.Column(db.String)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     heropowers = db.relationship('HeroPower', back_populates='power', cascade='all, delete-orphan')
     heroes = association_proxy('heropowers', 'hero')
@@ -60,6 +66,9 @@ class HeroPower(db.Model):
     power_id = db.Column(db.String, db.ForeignKey('powers.id'), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     hero = db.relationship('Hero', back_populates='heropowers')
     power = db.relationship('Power', back_populates='heropowers')
@@ -0,0 +1,200 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request, abort, jsonify, make_response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class _Sampler:
+    """Sample one thread's stack until stopped, counting collapsed stacks."""
+
+    def __init__(self, ident, interval):
+        self.ident = ident
+        self.interval = interval
+        self.stacks = Counter()
+        self.statements = []
+        self.current_sql = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            stack.reverse()
+            if self.current_sql:
+                stack.append(f'SQL {self.current_sql}')
+            if stack:
+                self.stacks[';'.join(stack)] += 1
+
+
+class Profiler:
+    """Opt-in per-request sampling profiler.
+
+    Nothing is registered unless PROFILING_TOKEN is set. A request is profiled
+    when its X-Profile header carries the token, or at random with probability
+    PROFILING_SAMPLE_RATE. The last PROFILING_KEEP profiles are kept on disk and
+    served from /_profiles, also gated by the token.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_TOKEN', os.environ.get('PROFILING_TOKEN'))
+        app.config.setdefault('PROFILING_SAMPLE_RATE', float(os.environ.get('PROFILING_SAMPLE_RATE', 0)))
+        app.config.setdefault('PROFILING_INTERVAL_MS', float(os.environ.get('PROFILING_INTERVAL_MS', 1)))
+        app.config.setdefault('PROFILING_KEEP', int(os.environ.get('PROFILING_KEEP', 50)))
+        app.config.setdefault('PROFILING_DIR', os.environ.get('PROFILING_DIR', os.path.join(app.instance_path, 'profiles')))
+        self.token = app.config['PROFILING_TOKEN']
+        if not self.token:
+            return
+        self.sample_rate = app.config['PROFILING_SAMPLE_RATE']
+        self.interval = app.config['PROFILING_INTERVAL_MS'] / 1000
+        self.keep = app.config['PROFILING_KEEP']
+        self.directory = app.config['PROFILING_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+        app.add_url_rule('/_profiles', 'profiles', self._list)
+        app.add_url_rule('/_profiles/<profile_id>', 'profile', self._collapsed)
+        app.add_url_rule('/_profiles/<profile_id>/sql', 'profile_sql', self._sql)
+
+    def _authorized(self):
+        # compare_digest rejects non-ASCII str, so compare the encoded bytes.
+        return hmac.compare_digest(request.headers.get('X-Profile', '').encode(), self.token.encode())
+
+    def _before_request(self):
+        if request.path.startswith('/_profiles'):
+            return
+        if self._authorized() or random.random() < self.sample_rate:
+            g.profile_started = time.perf_counter()
+            g.profile_sampler = _Sampler(threading.get_ident(), self.interval)
+            g.profile_sampler.start()
+
+    def _after_request(self, response):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return response
+        sampler.stop()
+        profile_id = f'{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}'
+        profile = {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.pop('profile_started')) * 1000, 3),
+            'sql': sampler.statements,
+            'stacks': dict(sampler.stacks),
+        }
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w') as f:
+            json.dump(profile, f)
+        self._trim()
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request is skipped when the view raises; don't leave the sampler running.
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+    def _trim(self):
+        # Ids start with a millisecond timestamp, so name order is age order.
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in names[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        sampler = g.get('profile_sampler') if g else None
+        if sampler is not None:
+            # Semicolons separate frames in the collapsed format.
+            sampler.current_sql = ' '.join(statement.split()).replace(';', ',')
+            context._profile_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        sampler = g.get('profile_sampler') if g else None
+        if sampler is not None:
+            self._record(sampler, context)
+
+    def _handle_error(self, exception_context):
+        # Failed statements skip after_cursor_execute, and are the ones most
+        # worth seeing in a profile.
+        sampler = g.get('profile_sampler') if g else None
+        if sampler is not None and sampler.current_sql is not None:
+            self._record(sampler, exception_context.execution_context,
+                         error=f'{exception_context.original_exception}')
+
+    def _record(self, sampler, context, error=None):
+        started = getattr(context, '_profile_started', None)
+        statement = {
+            'statement': sampler.current_sql,
+            'duration_ms': None if started is None else round((time.perf_counter() - started) * 1000, 3),
+        }
+        if error is not None:
+            statement['error'] = error
+        sampler.statements.append(statement)
+        sampler.current_sql = None
+
+    def _load(self, profile_id):
+        if not self._authorized():
+            abort(403)
+        path = os.path.join(self.directory, f'{os.path.basename(profile_id)}.json')
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            abort(404)
+
+    def _list(self):
+        if not self._authorized():
+            abort(403)
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profile = json.load(f)
+            except FileNotFoundError:
+                continue
+            profiles.append({key: profile[key] for key in ('id', 'method', 'path', 'status', 'duration_ms')})
+        return jsonify(profiles)
+
+    def _collapsed(self, profile_id):
+        profile = self._load(profile_id)
+        body = ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
+        response = make_response(body)
+        response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        response.headers['Content-Disposition'] = f'attachment; filename={profile_id}.collapsed'
+        return response
+
+    def _sql(self, profile_id):
+        return jsonify(self._load(profile_id)['sql'])
+
+
+profiler = Profiler()
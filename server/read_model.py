@@ -0,0 +1,394 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from multiprocessing import Array, Value
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Hero, Power, HeroPower
+
+HERO, POWER = 1, 2
+LOG_SIZE = 4096
+
+# Shared across gunicorn workers when created before the fork (preload_app).
+# Each commit appends the (kind, id) of the heroes and powers it touched to a
+# ring of LOG_SIZE entries; _version counts entries ever written. Workers
+# replay the entries they haven't seen, and only rebuild from scratch if they
+# fall more than LOG_SIZE entries behind.
+_version = Value('Q', 0)
+_log = Array('q', LOG_SIZE * 2, lock=False)
+
+
+def _publish(changes):
+    with _version.get_lock():
+        for kind, id in changes:
+            position = _version.value % LOG_SIZE
+            _log[position * 2] = kind
+            _log[position * 2 + 1] = id
+            _version.value += 1
+
+
+def _changes_since(version):
+    with _version.get_lock():
+        current = _version.value
+        if current - version > LOG_SIZE:
+            return current, None
+        changes = set()
+        for entry in range(version, current):
+            position = entry % LOG_SIZE
+            changes.add((_log[position * 2], _log[position * 2 + 1]))
+        return current, changes
+
+
+def _after_flush(session, flush_context):
+    changes = session.info.setdefault('read_model_changes', set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, Hero):
+            changes.add((HERO, instance.id))
+        elif isinstance(instance, Power):
+            changes.add((POWER, instance.id))
+        elif isinstance(instance, HeroPower):
+            # A PATCH can move the link, so both the old and new ends change.
+            state = inspect(instance)
+            for kind, key in ((HERO, 'hero_id'), (POWER, 'power_id')):
+                history = state.attrs[key].history
+                for id in history.sum():
+                    if id is not None:
+                        changes.add((kind, int(id)))
+
+
+def _after_commit(session):
+    changes = session.info.pop('read_model_changes', None)
+    if changes:
+        _publish(changes)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop('read_model_changes', None)
+
+
+class HeroRow:
+    __slots__ = ('_snapshot', '_offset')
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+
+    @property
+    def id(self):
+        return self._snapshot.heroes.id(self._offset)
+
+    @property
+    def name(self):
+        return self._snapshot.heroes.value(self._offset, 0)
+
+    @property
+    def super_name(self):
+        return self._snapshot.heroes.value(self._offset, 1)
+
+    @property
+    def version(self):
+        return self._snapshot.heroes.value(self._offset, 2)
+
+    @property
+    def powers(self):
+        snapshot = self._snapshot
+        alive = snapshot.powers.alive
+        return [PowerRow(snapshot, i) for i in snapshot.hero_links(self._offset) if alive(i)]
+
+
+class PowerRow:
+    __slots__ = ('_snapshot', '_offset')
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+
+    @property
+    def id(self):
+        return self._snapshot.powers.id(self._offset)
+
+    @property
+    def name(self):
+        return self._snapshot.powers.value(self._offset, 0)
+
+    @property
+    def description(self):
+        return self._snapshot.powers.value(self._offset, 1)
+
+    @property
+    def version(self):
+        return self._snapshot.powers.value(self._offset, 2)
+
+    @property
+    def heroes(self):
+        snapshot = self._snapshot
+        alive = snapshot.heroes.alive
+        return [HeroRow(snapshot, i) for i in snapshot.power_links(self._offset) if alive(i)]
+
+
+class _Strings:
+    """Strings packed into one UTF-8 buffer; row i is data[offsets[i]:offsets[i + 1]]."""
+
+    __slots__ = ('data', 'offsets', 'nulls')
+
+    def __init__(self, values):
+        encoded = [b'' if value is None else value.encode() for value in values]
+        self.nulls = bytes(value is None for value in values)
+        self.offsets = array('q', [0]) * (len(encoded) + 1)
+        total = 0
+        for i, value in enumerate(encoded):
+            total += len(value)
+            self.offsets[i + 1] = total
+        self.data = b''.join(encoded)
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode()
+
+
+class _Table:
+    """One table's rows as of the build, plus the changes applied since.
+
+    The build is held in flat buffers (a sorted id array searched with bisect,
+    packed strings, a version array) rather than per-row Python objects, so
+    reading it doesn't touch reference counts and its pages stay shared with
+    the preloading master. Later writes go into small per-worker overlays:
+    `changed` holds the current values of rows written since, `added` indexes
+    rows created since, and deleted build rows are cleared in `live`.
+    """
+
+    __slots__ = ('ids', 'columns', 'versions', 'live', 'added', 'added_ids', 'changed')
+
+    def __init__(self, rows):
+        # rows are (id, column 0, column 1, version), ordered by id.
+        self.ids = array('q', (row[0] for row in rows))
+        self.columns = (_Strings([row[1] for row in rows]), _Strings([row[2] for row in rows]))
+        self.versions = array('q', (row[3] for row in rows))
+        self.live = bytearray(b'\x01') * len(rows)
+        self.added = {}
+        self.added_ids = []
+        self.changed = {}
+
+    def _base(self, id):
+        i = bisect_left(self.ids, id)
+        return i if i < len(self.ids) and self.ids[i] == id else None
+
+    def offset(self, id):
+        i = self._base(id)
+        if i is not None:
+            return i if self.live[i] else None
+        return self.added.get(id)
+
+    def offsets(self):
+        live = self.live
+        built = [i for i in range(len(self.ids)) if live[i]]
+        # Ids handed out after the build are all above the built ones.
+        return built + [offset for id, offset in sorted(self.added.items())]
+
+    def alive(self, offset):
+        if offset < len(self.ids):
+            return self.live[offset]
+        return self.added.get(self.added_ids[offset - len(self.ids)]) == offset
+
+    def id(self, offset):
+        if offset < len(self.ids):
+            return self.ids[offset]
+        return self.added_ids[offset - len(self.ids)]
+
+    def value(self, offset, column):
+        # column 0 and 1 are the string columns, 2 is the version.
+        row = self.changed.get(offset)
+        if row is not None:
+            return row[column]
+        if column == 2:
+            return self.versions[offset]
+        return self.columns[column][offset]
+
+    def update(self, id, row):
+        """Apply the current (column 0, column 1, version) of id, or None if it's gone."""
+        i = self._base(id)
+        if row is None:
+            if i is not None:
+                self.live[i] = 0
+            self.added.pop(id, None)
+        elif i is not None:
+            self.changed[i] = row
+            self.live[i] = 1
+        elif id in self.added:
+            self.changed[self.added[id]] = row
+        else:
+            # Readers may be running; the row only becomes reachable once indexed.
+            offset = len(self.ids) + len(self.added_ids)
+            self.changed[offset] = row
+            self.added_ids.append(id)
+            self.added[id] = offset
+
+
+def _edges(pairs, size):
+    # CSR layout: edges[i]:edges[i + 1] is the slice of adjacency owned by row i.
+    # The sort is stable, so links keep their HeroPower.id order like the ORM path.
+    edges = array('l', [0]) * (size + 1)
+    adjacency = array('l')
+    for owner, target in sorted(pairs, key=lambda pair: pair[0]):
+        edges[owner + 1] += 1
+        adjacency.append(target)
+    for i in range(size):
+        edges[i + 1] += edges[i]
+    return edges, adjacency
+
+
+class Snapshot:
+    """Heroes, powers and the links between them, addressed by row offset.
+
+    Links from the build are CSR arrays; a row whose links changed since gets
+    an entry in hero_links_changed or power_links_changed that shadows them.
+    """
+
+    __slots__ = (
+        'version', 'heroes', 'powers',
+        'hero_edges', 'hero_adjacency', 'hero_links_changed',
+        'power_edges', 'power_adjacency', 'power_links_changed',
+    )
+
+    def __init__(self, version):
+        self.version = version
+        self.heroes = _Table(db.session.query(
+            Hero.id, Hero.name, Hero.super_name, Hero.version).order_by(Hero.id).all())
+        self.powers = _Table(db.session.query(
+            Power.id, Power.name, Power.description, Power.version).order_by(Power.id).all())
+        links = db.session.query(HeroPower.hero_id, HeroPower.power_id).order_by(HeroPower.id).all()
+
+        pairs = []
+        for hero_id, power_id in links:
+            hero_offset = self.heroes.offset(int(hero_id))
+            power_offset = self.powers.offset(int(power_id))
+            if hero_offset is not None and power_offset is not None:
+                pairs.append((hero_offset, power_offset))
+        self.hero_edges, self.hero_adjacency = _edges(pairs, len(self.heroes.ids))
+        self.power_edges, self.power_adjacency = _edges(
+            [(power, hero) for hero, power in pairs], len(self.powers.ids))
+        self.hero_links_changed = {}
+        self.power_links_changed = {}
+
+    def hero_links(self, offset):
+        links = self.hero_links_changed.get(offset)
+        if links is not None:
+            return links
+        if offset >= len(self.heroes.ids):
+            return ()
+        return self.hero_adjacency[self.hero_edges[offset]:self.hero_edges[offset + 1]]
+
+    def power_links(self, offset):
+        links = self.power_links_changed.get(offset)
+        if links is not None:
+            return links
+        if offset >= len(self.powers.ids):
+            return ()
+        return self.power_adjacency[self.power_edges[offset]:self.power_edges[offset + 1]]
+
+    def apply(self, changes):
+        heroes = [id for kind, id in changes if kind == HERO]
+        powers = [id for kind, id in changes if kind == POWER]
+        for hero_id in heroes:
+            self.heroes.update(hero_id, db.session.query(
+                Hero.name, Hero.super_name, Hero.version).filter(Hero.id == hero_id).first())
+        for power_id in powers:
+            self.powers.update(power_id, db.session.query(
+                Power.name, Power.description, Power.version).filter(Power.id == power_id).first())
+
+        # Links last, so they can point at rows added above.
+        for hero_id in heroes:
+            offset = self.heroes.offset(hero_id)
+            if offset is not None:
+                power_ids = db.session.query(HeroPower.power_id).filter(
+                    HeroPower.hero_id == hero_id).order_by(HeroPower.id).all()
+                offsets = (self.powers.offset(int(id)) for id, in power_ids)
+                self.hero_links_changed[offset] = array('l', (i for i in offsets if i is not None))
+        for power_id in powers:
+            offset = self.powers.offset(power_id)
+            if offset is not None:
+                hero_ids = db.session.query(HeroPower.hero_id).filter(
+                    HeroPower.power_id == power_id).order_by(HeroPower.id).all()
+                offsets = (self.heroes.offset(int(id)) for id, in hero_ids)
+                self.power_links_changed[offset] = array('l', (i for i in offsets if i is not None))
+
+
+class ReadModel:
+    def __init__(self):
+        self.enabled = False
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Nothing is read here: flask CLI commands such as `db upgrade` import the
+        # app too, and must run against a database the models don't match yet.
+        app.config.setdefault('READ_MODEL_ENABLED', os.environ.get('READ_MODEL_ENABLED') == '1')
+        self.enabled = app.config['READ_MODEL_ENABLED']
+        if self.enabled:
+            event.listen(Session, 'after_flush', _after_flush)
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_soft_rollback', _after_rollback)
+
+    def preload(self, app):
+        # Called from gunicorn's when_ready hook so the snapshot is built once in
+        # the master and shared with the workers it forks. Without it the first
+        # read in each worker builds one.
+        if self.enabled:
+            with app.app_context():
+                self.load()
+                # Don't let forked workers inherit the master's pooled SQLite
+                # connection; a connection can't be shared across fork().
+                db.session.remove()
+                db.engine.dispose()
+
+    def load(self):
+        self.snapshot = Snapshot(_version.value)
+        return self.snapshot
+
+    def current(self):
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == _version.value:
+            return snapshot
+        # Single flight: one thread catches up while the others keep serving the
+        # snapshot as it stands. Only the very first build makes readers wait.
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self.snapshot
+            if snapshot is None:
+                return self.load()
+            version, changes = _changes_since(snapshot.version)
+            if changes is None:
+                # Too far behind to replay. Build a new snapshot off to the side
+                # and swap it in, so rows already handed out stay consistent.
+                return self.load()
+            snapshot.apply(changes)
+            snapshot.version = version
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def heroes(self):
+        snapshot = self.current()
+        return [HeroRow(snapshot, offset) for offset in snapshot.heroes.offsets()]
+
+    def hero(self, id):
+        snapshot = self.current()
+        offset = snapshot.heroes.offset(id)
+        return None if offset is None else HeroRow(snapshot, offset)
+
+    def powers(self):
+        snapshot = self.current()
+        return [PowerRow(snapshot, offset) for offset in snapshot.powers.offsets()]
+
+    def power(self, id):
+        snapshot = self.current()
+        offset = snapshot.powers.offset(id)
+        return None if offset is None else PowerRow(snapshot, offset)
+
+
+read_model = ReadModel()